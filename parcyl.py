@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 import os
+import re
 import sys
+import json
 import shlex
+import socket
+import hashlib
 import logging
+import textwrap
 import warnings
 import functools
 import setuptools
@@ -13,8 +18,10 @@ from pathlib import Path
 from operator import attrgetter
 from collections import namedtuple, defaultdict
 
+from distutils.errors import (DistutilsError, DistutilsOptionError, DistutilsSetupError,
+                              DistutilsTemplateError)
 from distutils.version import StrictVersion
-from pkg_resources import (RequirementParseError,
+from pkg_resources import (RequirementParseError, parse_version,
                            Requirement as _RequirementBase)
 from setuptools.command.test import test as _TestCommand
 from setuptools.command.develop import develop as _DevelopCommand
@@ -203,6 +210,24 @@ version_info = Version({vinfo.major}, {vinfo.minor}, {vinfo.maint}, "{vinfo.rele
             print(self.attrs["release_name"])
             sys.argv.remove("--release-name")
 
+        build_manifest = None
+        if "--incremental" in sys.argv[1:]:
+            sys.argv.remove("--incremental")
+            commands = BuildManifest.commands(attrs, sys.argv[1:])
+            if commands and set(commands) <= set(BuildManifest.COMMANDS):
+                build_manifest = BuildManifest(attrs, sys.argv[1:])
+                if build_manifest.reusable():
+                    for artifact in build_manifest.artifacts:
+                        print(f"Reusing {artifact} (no changes since it was built)")
+                    return
+
+                for change in build_manifest.changes():
+                    print(f"Build input {change}")
+                build_manifest.begin()
+            else:
+                print(f"--incremental only applies to {' and '.join(BuildManifest.COMMANDS)}, "
+                      f"running a full build", file=sys.stderr)
+
         # The extra command line options we added cause warnings, quell that.
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", message="Unknown distribution option")
@@ -210,6 +235,9 @@ version_info = Version({vinfo.major}, {vinfo.minor}, {vinfo.maint}, "{vinfo.rele
 
             setuptools.setup(**attrs)
 
+        if build_manifest:
+            build_manifest.record()
+
     def with_packages(self, *pkg_dirs, exclude=None):
         pkgs = []
         if "packages" not in self.attrs:
@@ -220,6 +248,197 @@ version_info = Version({vinfo.major}, {vinfo.minor}, {vinfo.maint}, "{vinfo.rele
         return self
 
 
+def _stableState(obj):
+    """`obj` as JSON data that is the same in every process. Objects are reduced to their
+    attributes (e.g. an `Extension`'s name, sources, depends, macros, and flags), and classes
+    and functions to their qualified names, rather than a `repr` with a memory address.
+    """
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, dict):
+        return dict({str(key): _stableState(value) for key, value in obj.items()})
+    if isinstance(obj, (set, frozenset)):
+        return sorted([_stableState(value) for value in obj], key=json.dumps)
+    if isinstance(obj, (list, tuple)):
+        return list([_stableState(value) for value in obj])
+    if isinstance(obj, Path):
+        return str(obj)
+    if hasattr(obj, "__qualname__"):
+        return f"{getattr(obj, '__module__', '')}.{obj.__qualname__}"
+    if hasattr(obj, "__dict__"):
+        return {type(obj).__qualname__: _stableState(vars(obj))}
+    return str(obj)
+
+
+class BuildManifest:
+    """A content-addressed manifest (path, size, mtime, and sha256) of the files and metadata
+    that are input to a setup command line, and the artifacts it produced in `dist/`.
+    Builds with an unchanged manifest can reuse the previous artifacts.
+    """
+    MANIFEST_FILE = Path("build") / "parcyl" / "manifest.json"
+    DIST_D = Path("dist")
+    COMMANDS = ["sdist", "bdist_wheel"]
+    PROJECT_FILES = ["setup.py", "setup.cfg", "pyproject.toml", "MANIFEST.in", "README*",
+                     "LICENSE*"]
+
+    def __init__(self, setup_attrs, command):
+        self.command = " ".join(command)
+
+        self._manifests = {}
+        if self.MANIFEST_FILE.exists():
+            try:
+                self._manifests = dict(json.loads(self.MANIFEST_FILE.read_text()))
+            except ValueError:
+                _log.warning(f"Ignoring invalid build manifest: {self.MANIFEST_FILE}")
+        self._previous = self._manifests.get(self.command)
+
+        self.metadata = hashlib.sha256(json.dumps(_stableState(setup_attrs), sort_keys=True)
+                                       .encode()).hexdigest()
+        self._setup_attrs = setup_attrs
+        self.files = self._scan(self.inputFiles(setup_attrs),
+                                self._previous["files"] if self._previous else {})
+        self.artifacts = sorted(self._previous["artifacts"]) if self._previous else []
+        self._dist_snapshot = {}
+
+    @classmethod
+    def inputFiles(klass, attrs):
+        """The files an sdist or wheel of `attrs` is built from: the package directories
+        (recursively, which includes package data), modules, scripts, extension sources, data
+        files, the MANIFEST.in template, the SOURCES.txt of the previous build, and the
+        project files.
+        """
+        package_dir = attrs.get("package_dir") or {}
+        root = Path(package_dir.get("", "."))
+
+        def _pkgDir(pkg):
+            if pkg in package_dir:
+                return Path(package_dir[pkg])
+            return root.joinpath(*pkg.split("."))
+
+        paths = set()
+        for pkg in attrs.get("packages") or []:
+            if _pkgDir(pkg).is_dir():
+                paths.update([Path(f) for f in find_package_files(str(_pkgDir(pkg)), prefix="")])
+        for mod in attrs.get("py_modules") or []:
+            *parents, name = mod.split(".")
+            paths.add(root.joinpath(*parents, f"{name}.py"))
+        for ext in attrs.get("ext_modules") or []:
+            paths.update([Path(f) for f in list(ext.sources) + list(ext.depends or [])])
+        paths.update([Path(f) for f in attrs.get("scripts") or []])
+        for data_file in attrs.get("data_files") or []:
+            files = data_file[1] if isinstance(data_file, (tuple, list)) else [data_file]
+            paths.update([Path(f) for f in files])
+
+        manifest_in = Path("MANIFEST.in")
+        if manifest_in.exists():
+            # The same template processing as sdist
+            from setuptools.command.egg_info import FileList
+
+            file_list = FileList()
+            file_list.findall()
+            for line in manifest_in.read_text().splitlines():
+                if line.strip() and not line.strip().startswith("#"):
+                    try:
+                        file_list.process_template_line(line)
+                    except DistutilsTemplateError as err:
+                        _log.warning(f"MANIFEST.in: {err}")
+            paths.update([Path(f) for f in file_list.files])
+
+        for sources_txt in list(Path().glob("*.egg-info/SOURCES.txt")) + list(
+                root.glob("*.egg-info/SOURCES.txt")):
+            paths.update([Path(f) for f in sources_txt.read_text().splitlines() if f.strip()])
+
+        for pattern in klass.PROJECT_FILES:
+            paths.update(Path().glob(pattern))
+
+        def _generated(path):
+            return (path.parts[0] in ("build", "dist")
+                    or any([part.endswith(".egg-info") for part in path.parts]))
+
+        return sorted([p for p in paths if p.is_file() and not _generated(p)])
+
+    @staticmethod
+    def commands(attrs, argv):
+        """The setup commands in `argv`, or None if it does not parse."""
+        dist = setuptools.Distribution(dict(attrs, setup_requires=[]))
+        dist.script_name, dist.script_args = "setup.py", list(argv)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                if not dist.parse_command_line():
+                    return None
+        except (DistutilsError, SystemExit):
+            return None
+        return list(dist.commands)
+
+    @staticmethod
+    def _scan(paths, previous):
+        """Returns path -> [size, mtime, sha256], only hashing files whose size or mtime
+        differs from `previous`.
+        """
+        files = {}
+        for path in paths:
+            stat = path.stat()
+            prev = previous.get(str(path))
+            if prev and prev[:2] == [stat.st_size, stat.st_mtime_ns]:
+                files[str(path)] = prev
+            else:
+                files[str(path)] = [stat.st_size, stat.st_mtime_ns,
+                                    hashlib.sha256(path.read_bytes()).hexdigest()]
+        return files
+
+    def changes(self):
+        """Returns a list of changes since the previous build of this command line."""
+        if not self._previous:
+            return ["manifest: no previous build"]
+
+        changes = []
+        if self.metadata != self._previous["metadata"]:
+            changes.append("metadata: changed")
+
+        prev_files = self._previous["files"]
+        for path in sorted(set(self.files) | set(prev_files)):
+            if path not in prev_files:
+                changes.append(f"added: {path}")
+            elif path not in self.files:
+                changes.append(f"removed: {path}")
+            elif self.files[path][2] != prev_files[path][2]:
+                changes.append(f"modified: {path}")
+        return changes
+
+    def reusable(self):
+        """True when nothing changed and every previous artifact is still intact."""
+        if not self.artifacts or self.changes():
+            return False
+        return all([Path(path).is_file()
+                    and [Path(path).stat().st_size, Path(path).stat().st_mtime_ns] == stat
+                    for path, stat in self._previous["artifacts"].items()])
+
+    def _distStats(self):
+        if not self.DIST_D.is_dir():
+            return {}
+        return dict({str(p): [p.stat().st_size, p.stat().st_mtime_ns]
+                     for p in self.DIST_D.iterdir() if p.is_file()})
+
+    def begin(self):
+        self._dist_snapshot = self._distStats()
+
+    def record(self):
+        """Record the manifest, with the artifacts created since `begin`."""
+        # Rescanned, the build (re)wrote the SOURCES.txt that is part of the inputs
+        self.files = self._scan(self.inputFiles(self._setup_attrs), self.files)
+        artifacts = dict({path: stat for path, stat in self._distStats().items()
+                          if self._dist_snapshot.get(path) != stat})
+        self.artifacts = sorted(artifacts)
+
+        self._manifests[self.command] = {"metadata": self.metadata,
+                                         "files": self.files,
+                                         "artifacts": artifacts,
+                                         }
+        self.MANIFEST_FILE.parent.mkdir(parents=True, exist_ok=True)
+        self.MANIFEST_FILE.write_text(json.dumps(self._manifests, indent=2, sort_keys=True))
+
+
 @functools.total_ordering
 class Requirement:
 
@@ -395,49 +614,357 @@ class SetupRequirements:
 
         return reqs
 
-    def iterReqs(self, groups=None):
+    def iterReqs(self, groups=None, target=None, requirements_txt=False, req_d=_REQ_D):
+        """Yield a `RequirementsDotText` per requirements group, located in `req_d`.
+        When `target` (a `TargetEnvironment`) is given the requirements are filtered by their
+        environment markers and the files are located in a per-target directory.
+        """
         groups = groups or list([k for k in self._req_dict.keys()
                                     if self._req_dict[k] and (k in self.GROUPS or
                                                               k.startswith(_EXTRA))
                                 ]) + ["requirements"]
 
+        req_d = Path(req_d) / target.name if target else Path(req_d)
         for req_grp in [k for k in self._req_dict.keys() if self._req_dict[k] and k in groups]:
             # Individual requirements files
-            yield RequirementsDotText(_REQ_D / f"{req_grp}.txt", reqs=self._req_dict[req_grp],
-                                      pins=self.pins)
-
-    def write(self, groups=None, requirements_txt=False):
-        if not _REQ_D.exists():
-            raise NotADirectoryError(str(_REQ_D))
-
-        for reqs_txt in self.iterReqs(groups=groups):
-            reqs_txt.write()
-
-        # TODO: Future option of not including extras
-        include_extras = True
+            yield self._reqsDotText(req_d / f"{req_grp}.txt", self._req_dict[req_grp], target)
 
         if requirements_txt:
             # Make top-level requirements.txt files
-            pkg_reqs = []
-            for name, pkgs in self._req_dict.items():
-                if name == "install" or (name.startswith(self._EXTRA) and include_extras):
-                    pkg_reqs += pkgs or []
-
+            pkg_reqs = self._packageReqs()
             if pkg_reqs:
-                RequirementsDotText("requirements/requirements.txt", reqs=pkg_reqs,
-                                    pins=self.pins).write()
+                yield self._reqsDotText(req_d / "requirements.txt", pkg_reqs, target)
+
+    def iterLayers(self, num_layers, changes, target=None, req_d=_REQ_D):
+        """Yield a `RequirementsDotText` per layer of the install and extras requirements, the
+        files are named `layers/layer-<n>.txt`. Requirements are ordered by how often they
+        changed (`changes`, key -> count), and then by installed size (largest first), and
+        split evenly into `num_layers` layers (at most one per requirement) so the most stable
+        come first.
+        """
+        reqs = self._packageReqs()
+        if target:
+            reqs = target.filter(reqs)
+        if not reqs:
+            return
+
+        sizes = dict({r.key: 0 for r in reqs})
+        try:
+            footprint = Footprint(self)
+            for req in reqs:
+                sizes[req.key] = footprint._total(footprint.closure([req]))["bytes"]
+        except ImportError as err:
+            _log.warning(f"Layers are not ordered by size: {err}")
+        reqs.sort(key=lambda r: (changes.get(r.key, 0), -sizes[r.key], r.key))
+
+        req_d = Path(req_d) / target.name if target else Path(req_d)
+        num_layers = min(num_layers, len(reqs))
+        for n in range(num_layers):
+            layer = reqs[n * len(reqs) // num_layers:(n + 1) * len(reqs) // num_layers]
+            yield self._reqsDotText(req_d / "layers" / f"layer-{n}.txt", layer, target)
+
+    def _packageReqs(self):
+        """The install and extras requirements, i.e. the requirements.txt requirements."""
+        # TODO: Future option of not including extras
+        include_extras = True
+
+        pkg_reqs = []
+        for name, pkgs in self._req_dict.items():
+            if name == "install" or (name.startswith(self._EXTRA) and include_extras):
+                pkg_reqs += pkgs or []
+        return pkg_reqs
+
+    def _reqsDotText(self, filepath, reqs, target):
+        if target:
+            reqs = target.filter(reqs)
+        return RequirementsDotText(filepath, reqs=reqs, pins=self.pins, markers=target is None)
+
+    def render(self, groups=None, requirements_txt=False, targets=None, layers=0,
+               changes=None):
+        """Returns a dict of each requirements file path, relative to the requirements
+        directory, to its contents. Nothing is written.
+        With `layers` the layered requirements (see `iterLayers`) are included as well.
+        """
+        rendered = {}
+        for target in targets or [None]:
+            reqs_txts = list(self.iterReqs(groups=groups, target=target,
+                                           requirements_txt=requirements_txt, req_d=Path()))
+            if layers:
+                reqs_txts += list(self.iterLayers(layers, changes or {}, target=target,
+                                                  req_d=Path()))
+            for reqs_txt in reqs_txts:
+                rendered[reqs_txt.filepath] = reqs_txt.render()
+        return rendered
+
+    def write(self, groups=None, requirements_txt=False, targets=None, layers=0, changes=None,
+              output_dir=_REQ_D):
+        """Write the rendered requirements files to `output_dir`, returns the written paths."""
+        output_dir = Path(output_dir)
+        if not output_dir.exists():
+            raise NotADirectoryError(str(output_dir))
+
+        written = []
+        for relpath, contents in self.render(groups=groups, requirements_txt=requirements_txt,
+                                             targets=targets, layers=layers,
+                                             changes=changes).items():
+            path = output_dir / relpath
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(contents)
+            written.append(path)
+
+        return written
+
+    def checkConflicts(self):
+        """Raise `RequirementConflictError` if the specifiers of any package, across all
+        groups (including pins), can not be satisfied together.
+        """
+        conflicts = RequirementIndex(self._req_dict).conflicts()
+        if conflicts:
+            raise RequirementConflictError(conflicts)
 
     def __bool__(self):
         return bool(self._req_dict)
 
 
+class RequirementChanges(dict):
+    """The number of times each requirement (key) changed."""
+
+    @classmethod
+    def fromGit(klass, setup_cfg=SetupCfg.SETUP_CFG):
+        """Count the changes of each requirement in the git history of `setup_cfg`. Adding a
+        requirement after the first revision counts as a change, so new requirements do not
+        appear to be the most stable.
+        """
+        def _git(*args):
+            return subprocess.run(["git"] + list(args), stdout=subprocess.PIPE,
+                                  universal_newlines=True, check=True).stdout
+
+        # Relative to the current directory, as with `git log`, not the repository root
+        rev_path = f"./{os.path.relpath(str(setup_cfg))}"
+        changes = klass()
+        previous = None
+        for rev in _git("log", "--format=%H", "--reverse", "--", str(setup_cfg)).split():
+            config = configparser.ConfigParser()
+            try:
+                config.read_string(_git("show", f"{rev}:{rev_path}"))
+                reqs = SetupRequirements(config)
+            except (configparser.Error, RequirementParseError, subprocess.CalledProcessError):
+                _log.warning(f"Skipping unparsable {setup_cfg} at {rev}")
+                continue
+
+            current = dict({r.key: str(r) for grp, grp_reqs in reqs._req_dict.items()
+                            for r in grp_reqs})
+            for key, req in current.items():
+                changes.setdefault(key, 0)
+                if previous is not None and previous.get(key) != req:
+                    # Changed, added, or added back
+                    changes[key] += 1
+            previous = current
+
+        return changes
+
+    @classmethod
+    def fromFile(klass, path):
+        """Load recorded changes, a JSON object of requirement name -> change count."""
+        return klass({Requirement.parse(name).key: int(count)
+                      for name, count in json.loads(Path(path).read_text()).items()})
+
+
+class RequirementConflictError(ValueError):
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+
+        msg = "Requirement conflicts:"
+        for key, entries in conflicts.items():
+            groups = ", ".join([f"{grp}: {req}" for grp, req in entries])
+            msg += f"\n  {key} -> {groups}"
+        super().__init__(msg)
+
+
+class RequirementIndex:
+    """An index of each `Requirement.key` to its (group, requirement) entries in all groups."""
+
+    def __init__(self, req_dict):
+        self._index = defaultdict(list)
+        for group, reqs in req_dict.items():
+            for req in reqs:
+                self._index[req.key].append((group, req))
+
+    def __getitem__(self, key):
+        return self._index[key]
+
+    def conflicts(self):
+        """Returns a dict of key -> entries for each package with unsatisfiable specifiers.
+        Requirements without a marker always apply, those with a marker are only checked
+        together with the unmarked ones (and others with the same marker). Each specifier is
+        visited once, and at most twice for the combined marker cases.
+        """
+        conflicts = {}
+        for key, entries in self._index.items():
+            by_marker = defaultdict(list)
+            for grp, req in entries:
+                by_marker[str(req.marker) if req.marker else None].append((grp, req))
+
+            common = by_marker.pop(None, [])
+            common_bounds = _SpecBounds().update(common)
+            if not common_bounds.satisfiable():
+                conflicts[key] = common
+                continue
+
+            for marked in by_marker.values():
+                if not common_bounds.copy().update(marked).satisfiable():
+                    conflicts[key] = common + marked
+                    break
+
+        return conflicts
+
+
+class _SpecBounds:
+    """The intersection of version specifiers, kept as a lower/upper bound plus the
+    exact and excluded versions.
+    """
+    def __init__(self):
+        self.lower = None   # (version, inclusive)
+        self.upper = None   # (version, inclusive)
+        self.exact = set()
+        self.excluded = set()
+
+    def copy(self):
+        other = _SpecBounds()
+        other.lower, other.upper = self.lower, self.upper
+        other.exact, other.excluded = set(self.exact), set(self.excluded)
+        return other
+
+    def update(self, entries):
+        for _, req in entries:
+            for op, ver in req.specs:
+                self.add(op, ver)
+        return self
+
+    def add(self, op, ver):
+        if op in ("==", "===") and ver.endswith(".*"):
+            prefix = parse_version(ver[:-2])
+            self._setLower(prefix, True)
+            self._setUpper(parse_version(_bumpRelease(prefix.release)), False)
+        elif op in ("==", "==="):
+            self.exact.add(parse_version(ver))
+        elif op == "!=":
+            if not ver.endswith(".*"):
+                self.excluded.add(parse_version(ver))
+        elif op == "~=":
+            version = parse_version(ver)
+            self._setLower(version, True)
+            self._setUpper(parse_version(_bumpRelease(version.release[:-1])), False)
+        elif op in (">=", ">"):
+            self._setLower(parse_version(ver), op == ">=")
+        elif op in ("<=", "<"):
+            self._setUpper(parse_version(ver), op == "<=")
+        else:
+            raise NotImplementedError(f"No support for op {op}")
+
+    def _setLower(self, version, inclusive):
+        if (self.lower is None or version > self.lower[0]
+                or (version == self.lower[0] and not inclusive)):
+            self.lower = (version, inclusive)
+
+    def _setUpper(self, version, inclusive):
+        if (self.upper is None or version < self.upper[0]
+                or (version == self.upper[0] and not inclusive)):
+            self.upper = (version, inclusive)
+
+    def _inBounds(self, version):
+        if self.lower and (version < self.lower[0]
+                           or (version == self.lower[0] and not self.lower[1])):
+            return False
+        if self.upper and (version > self.upper[0]
+                           or (version == self.upper[0] and not self.upper[1])):
+            return False
+        return version not in self.excluded
+
+    def satisfiable(self):
+        if len(self.exact) > 1:
+            return False
+        elif self.exact:
+            return self._inBounds(next(iter(self.exact)))
+        elif self.lower and self.upper:
+            if self.lower[0] == self.upper[0]:
+                return self._inBounds(self.lower[0])
+            return self.lower[0] < self.upper[0]
+        return True
+
+
+def _bumpRelease(release):
+    """Increment the last component of a release tuple, e.g. (1, 4) -> "1.5"."""
+    if not release:
+        raise ValueError("Cannot increment an empty release")
+    return ".".join([str(r) for r in release[:-1]] + [str(release[-1] + 1)])
+
+
+class TargetEnvironment:
+    """An environment marker evaluation environment named like `py3.8-linux`, `pypy3.9-win`,
+    or just `py3.11` (platform markers then evaluate against the current platform).
+    """
+    _PY_RE = re.compile(r"^(?P<impl>py|pypy)(?P<major>\d)\.?(?P<minor>\d+)(?:\.(?P<micro>\d+))?$")
+    IMPLEMENTATIONS = {
+        "py": {"implementation_name": "cpython", "platform_python_implementation": "CPython"},
+        "pypy": {"implementation_name": "pypy", "platform_python_implementation": "PyPy"},
+    }
+    PLATFORMS = {
+        "linux": {"sys_platform": "linux", "platform_system": "Linux", "os_name": "posix"},
+        "darwin": {"sys_platform": "darwin", "platform_system": "Darwin", "os_name": "posix"},
+        "win": {"sys_platform": "win32", "platform_system": "Windows", "os_name": "nt"},
+    }
+    PLATFORMS["macos"] = PLATFORMS["darwin"]
+    PLATFORMS["windows"] = PLATFORMS["win"]
+
+    def __init__(self, name):
+        self.name = name
+        self.environment = self._parse(name)
+        self._marker_cache = {}
+
+    @classmethod
+    def _parse(klass, name):
+        py, _, platform = name.partition("-")
+        match = klass._PY_RE.match(py)
+        if not match or (platform and platform not in klass.PLATFORMS):
+            raise ValueError(f"Invalid target: {name} (expected e.g. py3.8-linux)")
+
+        major, minor, micro = match["major"], match["minor"], match["micro"] or "0"
+        # No extra is being installed, and markers that mention one must still evaluate
+        env = dict(klass.IMPLEMENTATIONS[match["impl"]], extra="",
+                   python_version=f"{major}.{minor}",
+                   python_full_version=f"{major}.{minor}.{micro}",
+                   implementation_version=f"{major}.{minor}.{micro}")
+        if platform:
+            env.update(klass.PLATFORMS[platform])
+        return env
+
+    def evaluate(self, marker):
+        """Evaluate `marker` for this target, None markers are always True.
+        Results are cached by marker since many requirements tend to share the same markers.
+        """
+        if marker is None:
+            return True
+
+        key = str(marker)
+        if key not in self._marker_cache:
+            self._marker_cache[key] = marker.evaluate(self.environment)
+        return self._marker_cache[key]
+
+    def filter(self, reqs):
+        return list([r for r in reqs if self.evaluate(r.marker)])
+
+    def __str__(self):
+        return self.name
+
+
 class RequirementsDotText:
-    def __init__(self, filepath, file=None, reqs=None, pins=None):
+    def __init__(self, filepath, file=None, reqs=None, pins=None, markers=True):
         self._reqs = {}
 
         if file:
             self._readReqsTxt(file)
-        elif reqs:
+        elif reqs is not None:
             self._reqs = dict({r.key: r for r in reqs})
         else:
             with open(filepath) as fp:
@@ -445,6 +972,7 @@ class RequirementsDotText:
 
         self.filepath = filepath
         self._pins = list(pins) if pins else []
+        self._markers = markers
 
     @property
     def requirements(self):
@@ -467,38 +995,312 @@ class RequirementsDotText:
             r = Requirement.parse(line)
             self._reqs[r.key] = r
 
-    def write(self):
+    def render(self):
+        """Returns the requirements file contents."""
 
         def specfmt(req: Requirement):
             if req.specs:
                 return Requirement.SpecsOpt.CURRENT
 
-        all_reqs = {}
         # FIXME: unused pins
         pins = {r.key: r for r in self._pins}  # noqa
-        for req in sorted(self._reqs.values()):
-            all_reqs[req.key] = req
+        return "".join([f"{req.toString(specfmt(req), marker=self._markers)}\n"
+                        for req in sorted(self._reqs.values())])
 
+    def write(self):
         filepath = Path(self.filepath)
-        file_exists = filepath.exists()
-        with filepath.open("r+" if file_exists else "w") as fp:
-            # FIXME: unused curr_reqs
-            curr_reqs = RequirementsDotText(filepath, file=fp if file_exists else None)  # noqa
+        filepath.write_text(self.render())
+        return filepath
+
+
+def _normalizeName(name):
+    """PEP 503 name normalization, e.g. `Foo_Bar.baz` -> `foo-bar-baz`."""
+    return re.sub(r"[-_.]+", "-", name).lower()
 
-            fp.seek(0)
-            fp.truncate(0)
-            for req in all_reqs.values():
-                fp.write(f"{req.toString(specfmt(req))}\n")
 
-            print(f"Wrote {filepath}")
+def _installedDistributions():
+    """A snapshot of the installed distributions, keyed by normalized name."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            raise ImportError("Python < 3.8 requires the `importlib_metadata` package "
+                              "(pip install importlib_metadata, or parcyl[footprint])"
+                              ) from None
+
+    dists = {}
+    for dist in metadata.distributions():
+        name = dist.metadata["Name"]
+        if name:
+            # First one wins, like the import system
+            dists.setdefault(_normalizeName(name), dist)
+    return dists
+
+
+class Footprint:
+    """The installed size of requirement groups and their transitive dependencies, computed
+    from the RECORD files of a single snapshot of the installed distributions.
+    """
+    def __init__(self, setup_reqs, dists=None):
+        self._setup_reqs = setup_reqs
+        self._dists = dists if dists is not None else _installedDistributions()
+        self._sizes = {}
+
+    def packageSize(self, key):
+        """Returns (bytes, file count) for an installed package, or None if not installed."""
+        if key not in self._sizes:
+            dist = self._dists.get(key)
+            if dist is None:
+                self._sizes[key] = None
+            else:
+                nbytes, nfiles = 0, 0
+                for f in dist.files or []:
+                    size = f.size
+                    if size is None:
+                        path = Path(f.locate())
+                        size = path.stat().st_size if path.is_file() else 0
+                    nbytes += size
+                    nfiles += 1
+                self._sizes[key] = (nbytes, nfiles)
+
+        return self._sizes[key]
+
+    def closure(self, reqs):
+        """Returns the set of normalized package names `reqs` (transitively) depend on.
+        Requirements whose markers do not apply to the current environment are skipped.
+        """
+        seen = set()
+        todo = [(r, ()) for r in reqs if not r.marker or r.marker.evaluate({"extra": ""})]
+        while todo:
+            req, _ = todo.pop()
+            key = _normalizeName(req.name)
+            extras = tuple(req.extras)
+            if (key, extras) in seen:
+                continue
+            seen.add((key, extras))
+
+            dist = self._dists.get(key)
+            for dep in (dist.requires or []) if dist else []:
+                dep = _RequirementBase.parse(dep)
+                if (not dep.marker
+                        or any([dep.marker.evaluate({"extra": e}) for e in ("",) + extras])):
+                    todo.append((dep, extras))
+
+        return set([key for key, _ in seen])
+
+    def _total(self, keys):
+        sizes = dict({k: self.packageSize(k) for k in keys if self.packageSize(k)})
+        return {"bytes": sum([s[0] for s in sizes.values()]),
+                "files": sum([s[1] for s in sizes.values()]),
+                "packages": sorted(sizes),
+                }
+
+    def report(self, groups=None):
+        req_dict = self._setup_reqs._req_dict
+        groups = groups or list([g for g in req_dict
+                                 if req_dict[g] and g != SetupRequirements._PINS])
+
+        install = self.closure(self._setup_reqs.install)
+        report = {"groups": {}, "packages": {}, "missing": []}
+        for group in groups:
+            keys = self.closure(req_dict.get(group, []))
+            report["groups"][group] = self._total(keys)
+            if group.startswith(_EXTRA):
+                report["groups"][group]["incremental"] = self._total(keys - install)
+
+            for key in keys:
+                size = self.packageSize(key)
+                if size is None:
+                    if key not in report["missing"]:
+                        report["missing"].append(key)
+                elif key not in report["packages"]:
+                    dist = self._dists[key]
+                    report["packages"][key] = {"name": dist.metadata["Name"],
+                                               "version": dist.version,
+                                               "bytes": size[0],
+                                               "files": size[1],
+                                               }
+        report["missing"].sort()
+        return report
+
+    @staticmethod
+    def formatReport(report):
+        def _size(nbytes):
+            for unit in ("B", "KiB", "MiB"):
+                if nbytes < 1024:
+                    return f"{nbytes:.1f} {unit}" if unit != "B" else f"{nbytes} B"
+                nbytes /= 1024
+            return f"{nbytes:.1f} GiB"
+
+        lines = []
+        for group, total in report["groups"].items():
+            lines.append(f"{group}: {_size(total['bytes'])} in {total['files']} files "
+                         f"({len(total['packages'])} packages)")
+            if "incremental" in total:
+                lines.append(f"  + {_size(total['incremental']['bytes'])} in "
+                             f"{total['incremental']['files']} files over install")
+
+            pkgs = [report["packages"][k] for k in total["packages"]]
+            for pkg in sorted(pkgs, key=lambda p: p["bytes"], reverse=True):
+                lines.append(f"  {pkg['name']} {pkg['version']}: {_size(pkg['bytes'])} in "
+                             f"{pkg['files']} files")
+
+        if report["missing"]:
+            lines.append(f"Not installed: {', '.join(report['missing'])}")
+        return "\n".join(lines)
+
+
+def _topLevelModules(dist):
+    """The importable top-level module names of an installed distribution."""
+    top_level = dist.read_text("top_level.txt")
+    if top_level:
+        modules = [m.strip() for m in top_level.splitlines() if m.strip()]
+    else:
+        modules = []
+        for f in dist.files or []:
+            parts = f.parts
+            if len(parts) == 2 and parts[1] == "__init__.py":
+                modules.append(parts[0])
+            elif len(parts) == 1 and parts[0].endswith((".py", ".so", ".pyd")):
+                modules.append(parts[0].split(".")[0])
+
+    return sorted(set([m for m in modules
+                       if m.isidentifier() and m != "__pycache__" and "/" not in m]))
+
+
+class ImportTime:
+    """Measures the cumulative time of importing the top-level modules of each requirement,
+    and of each group as a whole, using `python -X importtime` in fresh interpreters.
+    """
+    _MARKER = "--parcyl-importtime--"
+    _LINE_RE = re.compile(r"^import time:\s*\d+ \|\s*(?P<cumulative>\d+) \| (?P<name>\S+)$")
+
+    def __init__(self, setup_reqs, dists=None, jobs=None):
+        self._setup_reqs = setup_reqs
+        self._dists = dists if dists is not None else _installedDistributions()
+        self._jobs = jobs
+
+    @classmethod
+    def importTime(klass, modules):
+        """Import `modules` in a new interpreter and return the cumulative time in microseconds.
+        Raises `ImportError` when the import fails.
+        """
+        code = (f"import sys; sys.stderr.write('{klass._MARKER}\\n'); sys.stderr.flush(); "
+                + "; ".join([f"import {m}" for m in modules]))
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+        if proc.returncode != 0:
+            raise ImportError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip()
+                              else f"Error importing {', '.join(modules)}")
+
+        total = 0
+        output = proc.stderr.split(klass._MARKER, 1)[-1]
+        for line in output.splitlines():
+            match = klass._LINE_RE.match(line)
+            if match:
+                # Only the top-level imports, their cumulative time includes nested imports
+                total += int(match["cumulative"])
+        return total
+
+    def report(self, groups=None, budget=None):
+        """Returns the import times (in microseconds) per requirement and per group.
+        `budget` (in milliseconds) marks each group total as over budget, or not; groups that
+        fail to import are always over budget.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        req_dict = self._setup_reqs._req_dict
+        groups = groups or ["install"]
+
+        report = {"requirements": {}, "groups": {}, "missing": []}
+        group_modules = {}
+        for group in groups:
+            group_modules[group] = []
+            for req in req_dict.get(group, []):
+                if req.marker and not req.marker.evaluate({"extra": ""}):
+                    continue
+
+                key = _normalizeName(req.name)
+                dist = self._dists.get(key)
+                if dist is None:
+                    if key not in report["missing"]:
+                        report["missing"].append(key)
+                    continue
+
+                modules = _topLevelModules(dist)
+                report["requirements"].setdefault(key, {"groups": [], "modules": modules})
+                report["requirements"][key]["groups"].append(group)
+                group_modules[group] += [m for m in modules if m not in group_modules[group]]
+
+        def _run(modules):
+            try:
+                return ImportTime.importTime(modules), None
+            except ImportError as ex:
+                return None, str(ex)
+
+        # Each job is its own interpreter, threads suffice to keep them running in parallel.
+        with ThreadPoolExecutor(max_workers=self._jobs or os.cpu_count()) as pool:
+            req_jobs = {key: pool.submit(_run, info["modules"])
+                        for key, info in report["requirements"].items() if info["modules"]}
+            grp_jobs = {grp: pool.submit(_run, modules)
+                        for grp, modules in group_modules.items() if modules}
+
+            for key, info in report["requirements"].items():
+                us, error = req_jobs[key].result() if key in req_jobs else (0, None)
+                info.update(us=us, error=error)
+            for group in groups:
+                us, error = grp_jobs[group].result() if group in grp_jobs else (0, None)
+                # A group that fails to import can not be shown to be within budget
+                over_budget = budget is not None and (error is not None or us / 1000 > budget)
+                report["groups"][group] = {"us": us, "error": error, "over_budget": over_budget}
+
+        report["missing"].sort()
+        return report
+
+    @staticmethod
+    def failed(report, budget=None):
+        """True if any group is over budget, any import failed, or (with a budget) any
+        requirement is not installed and therefore not measured.
+        """
+        return bool(any([g["over_budget"] or g["error"] for g in report["groups"].values()])
+                    or any([r["error"] for r in report["requirements"].values()])
+                    or (budget is not None and report["missing"]))
+
+    @staticmethod
+    def formatReport(report):
+        lines = []
+        for group, total in report["groups"].items():
+            if total["error"]:
+                lines.append(f"{group}: error: {total['error']}")
+            else:
+                over = " (over budget)" if total["over_budget"] else ""
+                lines.append(f"{group}: {total['us'] / 1000:.1f} ms{over}")
+
+            reqs = [(key, info) for key, info in report["requirements"].items()
+                    if group in info["groups"]]
+            for key, info in sorted(reqs, key=lambda r: r[1]["us"] or 0, reverse=True):
+                if info["error"]:
+                    lines.append(f"  {key}: error: {info['error']}")
+                else:
+                    lines.append(f"  {key}: {info['us'] / 1000:.1f} ms "
+                                 f"({', '.join(info['modules']) or 'no modules'})")
+
+        if report["missing"]:
+            lines.append(f"Not installed: {', '.join(report['missing'])}")
+        return "\n".join(lines)
 
 
 class Pip:
     @staticmethod
     def install(*pkgs):
+        """Returns False if pip failed."""
         if len(pkgs):
             pkgs = list([shlex.quote(str(p)) for p in pkgs])
-            os.system(f"pip install {' '.join(pkgs)}")
+            return os.system(f"pip install {' '.join(pkgs)}") == 0
+        return True
 
 
 def _installExtras(dist):
@@ -507,7 +1309,9 @@ def _installExtras(dist):
     Environment markers in install_requires are moved to extras by setuptools for some reason.
     Therefore `install_requires=["dataclasses ; python_version < '3.7'"]` becomes
     `{':python_version < "3.7"': ['dataclasses']}` (note the prefixed ':').
+    Returns False if any of the installs failed.
     """
+    success = True
     for extra in dist.extras_require:
         pkgs = list(dist.extras_require[extra])
         if extra.startswith(":"):
@@ -515,27 +1319,102 @@ def _installExtras(dist):
             # Reassemble the markers so pip applies them
             pkgs = list([f"{p} ; {extra[1:]}" for p in pkgs])
 
-        Pip.install(*pkgs)
+        success = Pip.install(*pkgs) and success
+    return success
+
+
+def _checkConflicts():
+    try:
+        SetupRequirements().checkConflicts()
+    except RequirementConflictError as conflict:
+        raise DistutilsSetupError(str(conflict))
 
 
 class InstallCommand(_InstallCommand):
     def run(self):
+        _checkConflicts()
         Pip.install(*self.distribution.install_requires)
         return super().run()
 
 
 class DevelopCommand(_DevelopCommand):
-    def run(self):
-        Pip.install(*self.distribution.install_requires)
-        Pip.install(*self.distribution.tests_require)
-        Pip.install(*SetupRequirements().dev)
-        _installExtras(self.distribution)
+    user_options = _DevelopCommand.user_options + [
+        ("full", None, "Always install requirements and run the complete develop"),
+    ]
+    boolean_options = _DevelopCommand.boolean_options + ["full"]
 
-        return super().run()
+    DIGEST_FILE = Path("build") / "parcyl" / "develop.digest"
+
+    def initialize_options(self):
+        super().initialize_options()
+        self.full = False
+
+    def run(self):
+        digest = self._digest()
+        if not self.full and not self.uninstall and self._upToDate(digest):
+            print("Metadata, entry points, requirements, and extension sources are unchanged "
+                  "since the last develop, skipping (use --full to force)")
+            return
+
+        # Only a complete and successful develop is recorded
+        if self.DIGEST_FILE.exists():
+            self.DIGEST_FILE.unlink()
+
+        _checkConflicts()
+        installed = all([Pip.install(*self.distribution.install_requires),
+                         Pip.install(*self.distribution.tests_require),
+                         Pip.install(*SetupRequirements().dev),
+                         _installExtras(self.distribution),
+                         ])
+
+        result = super().run()
+
+        if not installed:
+            print("Installing requirements failed, the next develop will install them again",
+                  file=sys.stderr)
+        elif not self.uninstall:
+            self.DIGEST_FILE.parent.mkdir(parents=True, exist_ok=True)
+            self.DIGEST_FILE.write_text(digest)
+        return result
+
+    def _digest(self):
+        """A digest of what an editable install depends on. Python source files are not
+        included since they are used in place, but extension sources are, since develop
+        builds them in place.
+        """
+        dist = self.distribution
+        ext_files = set()
+        for ext in dist.ext_modules or []:
+            ext_files.update(list(ext.sources) + list(ext.depends or []))
+        state = {"python": sys.executable,
+                 "install_dir": self.install_dir,
+                 "metadata": vars(dist.metadata),
+                 "entry_points": dist.entry_points,
+                 "scripts": dist.scripts,
+                 "packages": dist.packages,
+                 "py_modules": dist.py_modules,
+                 "package_dir": dist.package_dir,
+                 "install_requires": dist.install_requires,
+                 "tests_require": dist.tests_require,
+                 "extras_require": dist.extras_require,
+                 "dev": list([str(r) for r in SetupRequirements().dev]),
+                 "ext_modules": dist.ext_modules,
+                 "ext_files": dict({f: hashlib.sha256(Path(f).read_bytes()).hexdigest()
+                                    if Path(f).is_file() else None
+                                    for f in sorted(ext_files)}),
+                 }
+        state = json.dumps(_stableState(state), sort_keys=True)
+        return hashlib.sha256(state.encode()).hexdigest()
+
+    def _upToDate(self, digest):
+        egg_info = self.get_finalized_command("egg_info").egg_info
+        return (self.DIGEST_FILE.exists() and self.DIGEST_FILE.read_text() == digest
+                and Path(egg_info).is_dir() and Path(self.egg_link).exists())
 
 
 class TestCommand(_TestCommand):
     def run(self):
+        _checkConflicts()
         Pip.install(*self.distribution.tests_require)
         Pip.install(*self.distribution.install_requires)
         _installExtras(self.distribution)
@@ -544,19 +1423,260 @@ class TestCommand(_TestCommand):
 
 
 class PyTestCommand(TestCommand):
-    user_options = [("pytest-args=", "a", "Arguments to pass to pytest")]
+    user_options = [("pytest-args=", "a", "Arguments to pass to pytest"),
+                    ("shards=", None, "Number of processes to split the test files across"),
+                   ]
 
     def initialize_options(self):
         _TestCommand.initialize_options(self)
         self.pytest_args = ""
+        self.shards = 1
+
+    def finalize_options(self):
+        super().finalize_options()
+        try:
+            self.shards = int(self.shards)
+        except ValueError:
+            raise DistutilsOptionError(f"--shards must be an integer: {self.shards}")
+        if self.shards < 1:
+            raise DistutilsOptionError(f"--shards must be at least 1: {self.shards}")
 
     def run_tests(self):
-        # import here, cause outside the eggs aren't loaded
-        import pytest
-        errno = pytest.main(shlex.split(self.pytest_args))
+        if self.shards > 1:
+            errno = PyTestShards(shlex.split(self.pytest_args), self.shards).run()
+        else:
+            # import here, cause outside the eggs aren't loaded
+            import pytest
+            errno = pytest.main(shlex.split(self.pytest_args))
         sys.exit(errno)
 
 
+class PyTestShards:
+    """Runs the test files collected by pytest in `num_shards` pytest processes. Files are
+    balanced across the shards, longest first, using the per-file durations recorded by
+    previous runs.
+
+    Every pytest process is given the original arguments, a plugin selects the collected
+    tests of the shard's files (and records the collected files, durations, and outcomes),
+    so no pytest options need to be parsed here. The shards' last failed and seen node IDs
+    are merged into the pytest cache once all have finished, rather than the last shard to
+    finish overwriting the others.
+    """
+    DURATIONS_FILE = Path(".pytest_cache") / "parcyl" / "durations.json"
+    MERGED_CACHE_KEYS = ["cache/lastfailed", "cache/nodeids"]
+
+    _RUNNER = textwrap.dedent("""\
+        import os, sys, json, collections, pytest
+
+        class ParcylShard:
+            def __init__(self, files, result, cache_keys):
+                self.files, self.result, self.cache_keys = files, result, cache_keys
+                self.collected = []
+                self.durations = collections.defaultdict(float)
+                self.outcomes = collections.defaultdict(int)
+                self.cache_dir, self.cache = None, {}
+
+            @pytest.hookimpl(trylast=True)
+            def pytest_configure(self, config):
+                self.cache_dir = os.path.join(
+                    str(getattr(config, "rootpath", None) or config.rootdir),
+                    os.path.expanduser(os.path.expandvars(config.getini("cache_dir"))))
+                if self.files is not None and getattr(config, "cache", None) is not None:
+                    # Recorded for the parent to merge, the cache is still read as usual
+                    cache_set = config.cache.set
+                    def _set(key, value):
+                        if key in self.cache_keys:
+                            self.cache[key] = value
+                        else:
+                            cache_set(key, value)
+                    config.cache.set = _set
+
+            def pytest_collection_modifyitems(self, config, items):
+                if self.files is not None:
+                    selected = [i for i in items if i.nodeid.split("::")[0] in self.files]
+                    deselected = [i for i in items if i.nodeid.split("::")[0] not in self.files]
+                    if deselected:
+                        config.hook.pytest_deselected(items=deselected)
+                        items[:] = selected
+
+            def pytest_collection_finish(self, session):
+                # After all deselection (e.g. -k)
+                self.collected = list(dict.fromkeys([i.nodeid.split("::")[0]
+                                                     for i in session.items]))
+
+            def pytest_runtest_logreport(self, report):
+                self.durations[report.nodeid.split("::")[0]] += report.duration
+                if report.when == "call" or (report.when == "setup" and report.skipped):
+                    self.outcomes["tests"] += 1
+                    self.outcomes[report.outcome] += 1
+                elif report.failed:
+                    self.outcomes["errors"] += 1
+
+            @pytest.hookimpl(trylast=True)
+            def pytest_sessionfinish(self, session):
+                # After the cache provider plugins set their values
+                with open(self.result, "w") as fp:
+                    json.dump({"collected": self.collected, "durations": self.durations,
+                               "outcomes": self.outcomes, "cache_dir": self.cache_dir,
+                               "cache": self.cache}, fp)
+
+        config = json.loads(sys.argv[1])
+        args = sys.argv[2:] + (["--collect-only"] if config["files"] is None else [])
+        sys.exit(pytest.main(args, plugins=[ParcylShard(config["files"], config["result"],
+                                                        config["cache_keys"])]))
+        """)
+
+    def __init__(self, pytest_args, num_shards):
+        self._args = list(pytest_args)
+        self._num_shards = num_shards
+
+    def _pytest(self, files, result, **popen_kwargs):
+        """Start a pytest process with the original arguments, running only `files` (all when
+        None), writing its collected files, durations, and outcomes to `result`.
+        """
+        config = json.dumps({"files": files, "result": str(result),
+                             "cache_keys": self.MERGED_CACHE_KEYS})
+        return subprocess.Popen([sys.executable, "-c", self._RUNNER, config] + self._args,
+                                **popen_kwargs)
+
+    def collect(self):
+        """Returns the test files pytest collects, in collection order."""
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as tmp_d:
+            result = Path(tmp_d) / "collect.json"
+            proc = self._pytest(None, result, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+            output, _ = proc.communicate()
+            if proc.returncode not in (0, 5) or not result.exists():
+                print(output, end="")
+                raise RuntimeError(f"pytest collection failed ({proc.returncode})")
+
+            return json.loads(result.read_text())["collected"]
+
+    def loadDurations(self):
+        if self.DURATIONS_FILE.exists():
+            try:
+                return dict(json.loads(self.DURATIONS_FILE.read_text()))
+            except ValueError:
+                _log.warning(f"Ignoring invalid durations file: {self.DURATIONS_FILE}")
+        return {}
+
+    @staticmethod
+    def balance(files, durations, num_shards):
+        """Assign `files` to at most `num_shards` lists, longest files first, each to the
+        currently shortest shard. Files without a duration are assumed to be average.
+        """
+        import heapq
+
+        known = [durations[f] for f in files if f in durations]
+        default = sum(known) / len(known) if known else 1.0
+
+        shards = [(0.0, i, []) for i in range(min(num_shards, len(files)))]
+        for f in sorted(files, key=lambda f: durations.get(f, default), reverse=True):
+            total, i, shard_files = heapq.heappop(shards)
+            shard_files.append(f)
+            heapq.heappush(shards, (total + durations.get(f, default), i, shard_files))
+
+        return [shard_files for _, _, shard_files in sorted(shards, key=lambda s: s[1])]
+
+    def run(self):
+        import tempfile
+
+        files = self.collect()
+        if not files:
+            print("No tests collected")
+            return 5
+
+        durations = self.loadDurations()
+        shards = self.balance(files, durations, self._num_shards)
+        with tempfile.TemporaryDirectory() as tmp_d:
+            procs = []
+            for i, shard_files in enumerate(shards):
+                result = Path(tmp_d) / f"shard-{i}.json"
+                output = (Path(tmp_d) / f"shard-{i}.out").open("w+")
+                proc = self._pytest(shard_files, result, stdout=output, stderr=subprocess.STDOUT)
+                procs.append((proc, output, result, shard_files))
+
+            exit_codes = []
+            totals = defaultdict(int)
+            shard_caches = []
+            for i, (proc, output, result, shard_files) in enumerate(procs):
+                exit_codes.append(proc.wait())
+                output.seek(0)
+                print(f"=== shard {i + 1}/{len(procs)}: {len(shard_files)} files ===")
+                print(output.read(), end="")
+                output.close()
+
+                if result.exists():
+                    shard_result = json.loads(result.read_text())
+                    for outcome, count in shard_result["outcomes"].items():
+                        totals[outcome] += count
+                    durations.update(shard_result["durations"])
+                    shard_caches.append((shard_files, shard_result["cache"]))
+                    cache_dir = shard_result["cache_dir"]
+
+            if shard_caches:
+                self.mergeCache(cache_dir, shard_caches)
+
+        self.DURATIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        self.DURATIONS_FILE.write_text(json.dumps(durations, indent=2, sort_keys=True))
+
+        errno = self.mergeExitCodes(exit_codes)
+        print(f"=== {len(procs)} shards: {totals['tests']} tests, {totals['failed']} failed, "
+              f"{totals['errors']} errors, {totals['skipped']} skipped (exit {errno}) ===")
+        return errno
+
+    @classmethod
+    def mergeCache(klass, cache_dir, shard_caches):
+        """Merge the cache values of the shards, a list of (shard files, {key: value}), into
+        the pytest cache in `cache_dir`. Each shard's values are taken for the node IDs of its
+        own files, the existing values for the files of other shards that did not change them
+        (and files no shard ran).
+        """
+        def _file(nodeid):
+            return nodeid.split("::")[0]
+
+        values_d = Path(cache_dir) / "v"
+        for key in klass.MERGED_CACHE_KEYS:
+            if not any([key in cache for _, cache in shard_caches]):
+                continue
+
+            path = values_d / key
+            try:
+                merged = json.loads(path.read_text()) if path.exists() else None
+            except ValueError:
+                merged = None
+
+            if key == "cache/nodeids":
+                merged = set(merged or [])
+                for _, cache in shard_caches:
+                    merged.update(cache.get(key, []))
+                merged = sorted(merged)
+            else:
+                merged = dict(merged or {})
+                for shard_files, cache in shard_caches:
+                    if key in cache:
+                        shard_files = set(shard_files)
+                        merged = dict({nodeid: value for nodeid, value in merged.items()
+                                       if _file(nodeid) not in shard_files})
+                        merged.update({nodeid: value for nodeid, value in cache[key].items()
+                                       if _file(nodeid) in shard_files})
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(merged, indent=2, sort_keys=True))
+
+    @staticmethod
+    def mergeExitCodes(exit_codes):
+        """The worst exit code, where "no tests collected" (5) only counts if all shards had
+        no tests.
+        """
+        failed = [c for c in exit_codes if c not in (0, 5)]
+        if failed:
+            return max(failed)
+        return 0 if 0 in exit_codes else 5
+
+
 def find_package_files(directory, prefix=".."):
     paths = []
     for (path, _, filenames) in os.walk(directory):
@@ -569,28 +1689,229 @@ def find_package_files(directory, prefix=".."):
     return paths
 
 
-def parseVersion(v):
-    from pkg_resources import parse_version
-    from pkg_resources.extern.packaging.version import Version
-
-    # Some validation and normalization (e.g. 1.0-a1 -> 1.0a1)
-    V = parse_version(v)
-    if not isinstance(V, Version):
+# PEP 440 versions, see https://www.python.org/dev/peps/pep-0440/#appendix-b-parsing-version-strings
+_VERSION_RE = re.compile(r"""
+    ^\s*v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?P<pre>[-_.]?(?P<pre_l>a|b|c|rc|alpha|beta|pre|preview)[-_.]?(?P<pre_n>[0-9]+)?)?
+    (?P<post>(?:-(?P<post_n1>[0-9]+))
+             |(?:[-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>[0-9]+)?))?
+    (?P<dev>[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>[0-9]+)?)?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+    \s*$
+""", re.VERBOSE | re.IGNORECASE)
+_PRE_RELEASES = {"a": "a", "alpha": "a", "b": "b", "beta": "b",
+                 "c": "rc", "rc": "rc", "pre": "rc", "preview": "rc"}
+
+VersionInfo = namedtuple("VersionInfo", "major, minor, maint, release, epoch, post, dev, local")
+
+
+@functools.lru_cache(maxsize=8192)
+def _parseVersion(v):
+    match = _VERSION_RE.match(v)
+    if not match:
         raise ValueError(f"Invalid version: {v}")
 
-    ver = str(V)
-    if V._version.pre:
-        rel = "".join([str(v) for v in V._version.pre])
+    epoch = int(match["epoch"] or 0)
+    release = tuple([int(r) for r in match["release"].split(".")])
+    pre = None
+    if match["pre"]:
+        pre = (_PRE_RELEASES[match["pre_l"].lower()], int(match["pre_n"] or 0))
+    post = int(match["post_n1"] or match["post_n2"] or 0) if match["post"] else None
+    dev = int(match["dev_n"] or 0) if match["dev"] else None
+    local = re.sub(r"[-_]", ".", match["local"].lower()) if match["local"] else None
+
+    # Normalized, e.g. 1.0-a1 -> 1.0a1
+    ver = f"{epoch}!" if epoch else ""
+    ver += ".".join([str(r) for r in release])
+    ver += f"{pre[0]}{pre[1]}" if pre else ""
+    ver += f".post{post}" if post is not None else ""
+    ver += f".dev{dev}" if dev is not None else ""
+    ver += f"+{local}" if local else ""
+
+    info = VersionInfo(release[0], release[1] if len(release) > 1 else 0,
+                       release[2] if len(release) > 2 else 0,
+                       f"{pre[0]}{pre[1]}" if pre else "final", epoch, post, dev, local)
+
+    # The PEP 440 ordering as plain tuples: trailing zeros of the release are insignificant,
+    # dev releases sort before pre-releases, and those before the final and post releases.
+    trimmed = release
+    while len(trimmed) > 1 and trimmed[-1] == 0:
+        trimmed = trimmed[:-1]
+    if pre:
+        pre_key = (1,) + pre
     else:
-        rel = "final"
+        pre_key = (0, "", 0) if dev is not None and post is None else (2, "", 0)
+    post_key = (0, 0) if post is None else (1, post)
+    dev_key = (1, 0) if dev is None else (0, dev)
+    local_key = tuple([(1, int(p), "") if p.isdigit() else (0, 0, p)
+                       for p in local.split(".")]) if local else ()
+
+    return ver, info, (epoch, trimmed, pre_key, post_key, dev_key, local_key)
+
+
+def parseVersion(v):
+    """Parse and normalize a PEP 440 version string, returns (normalized_version, VersionInfo).
+    Raises `ValueError` for invalid versions. Results are cached.
+    """
+    ver, info, _ = _parseVersion(v)
+    return ver, info
+
+
+def versionKey(v):
+    """A sort key for version string `v` that orders versions per PEP 440."""
+    return _parseVersion(v)[2]
+
+
+def parseVersions(versions, strict=True):
+    """Parse many version strings, returns a list of (version, normalized_version, VersionInfo).
+    Invalid versions raise `ValueError` unless `strict` is False, then they are skipped.
+    """
+    parsed = []
+    for v in versions:
+        try:
+            parsed.append((v,) + parseVersion(v))
+        except ValueError:
+            if strict:
+                raise
+    return parsed
+
+
+def sortVersions(versions, reverse=False, strict=True):
+    """Sort version strings per PEP 440. Invalid versions raise `ValueError` unless `strict` is
+    False, then they are dropped.
+    """
+    return sorted([v for v, _, _ in parseVersions(versions, strict=strict)], key=versionKey,
+                  reverse=reverse)
+
 
-    # Although parsed the following components are not captured: post, dev, local, epoch
-    Version = namedtuple("Version", "major, minor, maint, release")
-    ver_info = Version(V._version.release[0],
-                       V._version.release[1] if len(V._version.release) > 1 else 0,
-                       V._version.release[2] if len(V._version.release) > 2 else 0,
-                       rel)
-    return ver, ver_info
+class ProjectQueries:
+    """Answers metadata and requirements queries, e.g. `{"attr": "version"}` or
+    `{"requirements": "install"}`, from a `SetupCfg` that is reloaded when setup.cfg changes.
+    """
+    def __init__(self):
+        import threading
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._config = None
+
+    @property
+    def config(self):
+        setup_cfg = SetupCfg.SETUP_CFG
+        stat = setup_cfg.stat() if setup_cfg.exists() else None
+        mtime = (stat.st_mtime_ns, stat.st_size) if stat else None
+        with self._lock:
+            if self._config is None or mtime != self._mtime:
+                self._config, self._mtime = SetupCfg(), mtime
+            return self._config
+
+    def answer(self, request):
+        """Returns the answer for `request`, raises ValueError for invalid requests and for an
+        invalid setup.cfg.
+        """
+        if (not isinstance(request, dict) or len(request) != 1
+                or not all([isinstance(v, str) for v in request.values()])):
+            raise ValueError(f"Invalid query: {request}")
+
+        try:
+            config = self.config
+        except (configparser.Error, RequirementParseError) as err:
+            raise ValueError(f"Invalid {SetupCfg.SETUP_CFG}: {err}") from err
+
+        if "attr" in request:
+            if request["attr"] not in config.attrs:
+                raise ValueError(f"Unknown attribute: {request['attr']}")
+            value = config.attrs[request["attr"]]
+            return value._asdict() if isinstance(value, VersionInfo) else value
+        elif "requirements" in request:
+            return list([str(r) for r in config.requirements._getter(request["requirements"])])
+        else:
+            raise ValueError(f"Invalid query: {request}")
+
+
+class ParcylServer:
+    """A daemon answering `ProjectQueries` on a Unix socket, one JSON request per line."""
+    SOCKET = Path(".parcyl.sock")
+
+    def __init__(self, socket_path=None):
+        self.socket_path = Path(socket_path or self.SOCKET)
+        self.queries = ProjectQueries()
+        self._server = None
+
+    def serve(self):
+        import socketserver
+
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            raise NotImplementedError("Unix sockets are not supported on this platform")
+
+        queries = self.queries
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = {"result": queries.answer(json.loads(line))}
+                    except ValueError as err:
+                        response = {"error": str(err)}
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+                    self.wfile.flush()
+
+        if self.socket_path.exists():
+            running = _connect(self.socket_path)
+            if running:
+                running.close()
+                raise OSError(f"A server is already running on {self.socket_path}")
+            self.socket_path.unlink()
+
+        self._server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), _Handler)
+        self._server.daemon_threads = True
+        try:
+            print(f"Serving on {self.socket_path}")
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+            self.socket_path.unlink()
+
+    def shutdown(self):
+        """Stop `serve`, from another thread."""
+        self._server.shutdown()
+
+
+def _connect(socket_path, timeout=1.0):
+    """A connected socket to a running `ParcylServer`, or None."""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(socket_path))
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+def query(request, socket_path=None):
+    """Answer `request` using a running `ParcylServer`, or in-process when none is running.
+    Raises ValueError for invalid requests.
+    """
+    sock = _connect(socket_path or ParcylServer.SOCKET)
+    if sock is None:
+        return ProjectQueries().answer(request)
+
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps(request).encode() + b"\n")
+        stream.flush()
+        response = json.loads(stream.readline())
+
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response["result"]
 
 
 def _pipCompile(path):
@@ -617,6 +1938,54 @@ def _main():
                         help="Write a requirements.txt file composed of install and all extras.")
     reqs_p.add_argument("-C", "--compile", dest="compile", action="store_true",
                         help="Compile requirement files.")
+    reqs_p.add_argument("-t", "--target", dest="targets", action="store", default=None,
+                        help="Comma separated target environments (e.g. py3.8-linux,py3.11-win) "
+                             "for which marker-free requirements/<target>/*.txt files are "
+                             "written.")
+    reqs_p.add_argument("--check-conflicts", dest="check_conflicts", action="store_true",
+                        help="Fail if the specifiers for a package in any of the groups "
+                             "conflict.")
+    reqs_p.add_argument("-o", "--output-dir", dest="output_dir", action="store", type=Path,
+                        default=_REQ_D,
+                        help=f"Directory to write the requirement files to (default: {_REQ_D}).")
+    reqs_p.add_argument("--stdout", dest="stdout", action="store_true",
+                        help="Print the requirement files rather than writing them.")
+    reqs_p.add_argument("-L", "--layers", dest="layers", type=int, default=0,
+                        help="Also write the install and extras requirements split into this "
+                             "many layers/layer-<n>.txt files, most stable first.")
+    reqs_p.add_argument("--changes", dest="changes", type=Path, default=None,
+                        help="A JSON file of requirement -> change count used to order the "
+                             "layers (default: the git history of setup.cfg).")
+
+    fprint_p = subcmds.add_parser("footprint",
+                                  help="Report the installed size of requirement groups.")
+    fprint_p.add_argument("req_group", action="store", nargs="*",
+                          help="Which requirements group(s) to report on (default: all).")
+    fprint_p.add_argument("--json", dest="json", action="store_true",
+                          help="Output JSON rather than text.")
+
+    imptime_p = subcmds.add_parser("importtime",
+                                   help="Report the import time of install requirements.")
+    imptime_p.add_argument("-E", "--extras", dest="extras", action="store_true",
+                           help="Include the extra_* requirement groups.")
+    imptime_p.add_argument("-b", "--budget", dest="budget", type=float, default=None,
+                           help="Fail when a group's import time (in ms) exceeds this budget.")
+    imptime_p.add_argument("-j", "--jobs", dest="jobs", type=int, default=None,
+                           help="Number of imports to run in parallel (default: CPU count).")
+    imptime_p.add_argument("--json", dest="json", action="store_true",
+                           help="Output JSON rather than text.")
+
+    serve_p = subcmds.add_parser("serve",
+                                 help="Serve metadata and requirement queries on a Unix socket.")
+    query_p = subcmds.add_parser("query",
+                                 help="Query metadata (attr) or requirements (requirements), "
+                                      "using `parcyl serve` when it is running.")
+    query_p.add_argument("query_type", choices=["attr", "requirements"],
+                         help="What to query.")
+    query_p.add_argument("query_name", help="The attribute name or requirements group.")
+    for sub_p in (serve_p, query_p):
+        sub_p.add_argument("--socket", dest="socket", type=Path, default=ParcylServer.SOCKET,
+                           help=f"The server socket path (default: {ParcylServer.SOCKET}).")
 
     args = p.parse_args()
 
@@ -632,17 +2001,96 @@ def _main():
 
     elif args.cmd == "requirements":
         try:
+            targets = None
+            if args.targets:
+                targets = list([TargetEnvironment(t.strip())
+                                for t in args.targets.split(",") if t.strip()])
+
             req = SetupRequirements()
-            if req:
-                req.write(groups=args.req_group or None, requirements_txt=args.requirements_txt)
+            if args.check_conflicts:
+                req.checkConflicts()
+
+            if args.stdout and args.compile:
+                raise ValueError("--compile requires writing files, it can not be used with "
+                                 "--stdout")
+
+            if args.changes and not args.layers:
+                reqs_p.error("--changes requires --layers")
+
+            changes = None
+            if args.layers:
+                changes = (RequirementChanges.fromFile(args.changes) if args.changes
+                           else RequirementChanges.fromGit())
+
+            if req and args.stdout:
+                for relpath, contents in req.render(groups=args.req_group or None,
+                                                    requirements_txt=args.requirements_txt,
+                                                    targets=targets, layers=args.layers,
+                                                    changes=changes).items():
+                    print(f"# {relpath}\n{contents}")
+            elif req:
+                for path in req.write(groups=args.req_group or None,
+                                      requirements_txt=args.requirements_txt, targets=targets,
+                                      layers=args.layers, changes=changes,
+                                      output_dir=args.output_dir):
+                    print(f"Wrote {path}")
 
             if args.compile:
-                for req_txt in req.iterReqs(groups=args.req_group or None):
-                    _pipCompile(req_txt.filepath)
-        except (RequirementParseError, subprocess.CalledProcessError) as req_err:
+                for target in targets or [None]:
+                    for req_txt in req.iterReqs(groups=args.req_group or None, target=target,
+                                                req_d=args.output_dir):
+                        _pipCompile(req_txt.filepath)
+        except (RequirementParseError, subprocess.CalledProcessError, ValueError,
+                NotADirectoryError) as req_err:
             print(req_err, file=sys.stderr)
             return 1
 
+    elif args.cmd == "footprint":
+        try:
+            report = Footprint(SetupRequirements()).report(groups=args.req_group or None)
+        except ImportError as err:
+            print(err, file=sys.stderr)
+            return 1
+
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(Footprint.formatReport(report))
+
+    elif args.cmd == "importtime":
+        req = SetupRequirements()
+        groups = ["install"]
+        if args.extras:
+            groups += sorted([_EXTRA + extra for extra in req.extras])
+
+        try:
+            report = ImportTime(req, jobs=args.jobs).report(groups=groups, budget=args.budget)
+        except ImportError as err:
+            print(err, file=sys.stderr)
+            return 1
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(ImportTime.formatReport(report))
+
+        if ImportTime.failed(report, budget=args.budget):
+            return 1
+
+    elif args.cmd == "serve":
+        ParcylServer(args.socket).serve()
+
+    elif args.cmd == "query":
+        try:
+            result = query({args.query_type: args.query_name}, socket_path=args.socket)
+        except ValueError as err:
+            print(err, file=sys.stderr)
+            return 1
+
+        if args.query_type == "requirements":
+            print("\n".join(result))
+        else:
+            print(result if isinstance(result, str) else json.dumps(result))
+
 
 find_packages = setuptools.find_packages
 __all__ = ["Setup", "setup", "find_packages", "find_package_files"]
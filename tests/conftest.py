@@ -1,3 +1,4 @@
+import os
 import sys
 import textwrap
 import subprocess
@@ -50,7 +51,8 @@ class ParcylDir:
         self._withFile("setup.cfg", contents)
         return self
 
-    def setup(self, cmd, check=True):
+    def setup(self, cmd, check=True, env=None):
         proc = subprocess.run(f"{sys.executable} setup.py {cmd}",
-                              cwd=str(self.path), shell=True, check=check)
+                              cwd=str(self.path), shell=True, check=check,
+                              env=dict(os.environ, **env) if env else None)
         return proc
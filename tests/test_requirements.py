@@ -1,6 +1,11 @@
 import sys
+import json
+import configparser
+from pathlib import Path
 import pytest
-from parcyl import Requirement, parseVersion
+from parcyl import (Footprint, ImportTime, Requirement, RequirementChanges,
+                    RequirementConflictError, SetupRequirements, TargetEnvironment,
+                    parseVersion, parseVersions, sortVersions, versionKey)
 
 
 def test_Req_parse():
@@ -105,3 +110,245 @@ def test_parseVersionInvalid():
     for V in ("Slapshot", "Slapshot-1.0"):
         with pytest.raises(ValueError):
             parseVersion(V)
+
+
+def test_TargetEnvironment():
+    req = Requirement.parse("pathlib ; python_version < '3.4'")
+    win_req = Requirement.parse("pywin32 ; sys_platform == 'win32'")
+
+    py33 = TargetEnvironment("py3.3-linux")
+    assert py33.evaluate(req.marker)
+    assert not py33.evaluate(win_req.marker)
+    assert py33.evaluate(None)
+    assert py33.filter([req, win_req]) == [req]
+    assert req.toString(marker=False) == "pathlib"
+
+    py311 = TargetEnvironment("py3.11-win")
+    assert py311.filter([req, win_req]) == [win_req]
+
+    extra_req = Requirement.parse("foo ; extra == 'bar'")
+    assert py311.filter([extra_req]) == []
+
+    for bad in ("python3.8", "py3.8-beos", "3.8-linux"):
+        with pytest.raises(ValueError):
+            TargetEnvironment(bad)
+
+
+def _setupReqs(reqs_cfg):
+    cfg = configparser.ConfigParser()
+    cfg.read_string(f"[parcyl:requirements]\n{reqs_cfg}")
+    return SetupRequirements(cfg)
+
+
+def test_checkConflicts():
+    for ok in ("install = foo>=1.0\ntest = foo<2\ndev = foo!=1.5",
+               "install = foo~=1.4\ndev = foo==1.9",
+               "install = foo==1.4.*\ntest = foo>=1.4.2",
+               "install = foo<2 ; python_version < '3'\n  bar\n"
+               "test = foo>=2 ; python_version >= '3'",
+               "install = foo>=1\n  foo<=1"):
+        _setupReqs(ok).checkConflicts()
+
+    for bad in ("install = foo>=2\ntest = foo<2",
+                "install = foo==1.0\ndev = foo==1.1",
+                "install = foo~=1.4\nextra_bar = foo>=2",
+                "install = foo==1.4.*\nextra_bar = foo==1.5",
+                "install = foo>1\ndev = foo<=1",
+                "install = foo<2\ndev = foo>=3 ; python_version >= '3'",
+                "install = foo\npins = foo==1.0\ntest = foo!=1.0"):
+        with pytest.raises(RequirementConflictError) as err:
+            _setupReqs(bad).checkConflicts()
+        assert list(err.value.conflicts) == ["foo"]
+
+    with pytest.raises(RequirementConflictError) as err:
+        _setupReqs("install = foo>=2\n  bar\nextra_baz = foo<2").checkConflicts()
+    assert "install: foo>=2" in str(err.value)
+    assert "extra_baz: foo<2" in str(err.value)
+
+
+def test_Footprint():
+    footprint = Footprint(_setupReqs("install = pytest\nextra_foo = pytest\n  not-installed-pkg"))
+    assert {"pytest", "pluggy"} <= footprint.closure(footprint._setup_reqs.install)
+
+    report = footprint.report()
+    assert set(report["groups"]) == {"install", "extra_foo"}
+    assert report["groups"]["install"]["bytes"] > 0
+    assert report["groups"]["install"]["files"] >= report["packages"]["pytest"]["files"]
+    assert report["groups"]["extra_foo"]["incremental"]["bytes"] == 0
+    assert report["missing"] == ["not-installed-pkg"]
+    assert "pytest" in Footprint.formatReport(report)
+
+
+def test_ImportTime():
+    assert ImportTime.importTime(["json"]) > 0
+    with pytest.raises(ImportError):
+        ImportTime.importTime(["not_a_module_at_all"])
+
+    report = ImportTime(_setupReqs("install = pluggy\n  not-installed-pkg"))\
+        .report(budget=0.000001)
+    assert report["requirements"]["pluggy"]["modules"] == ["pluggy"]
+    assert report["requirements"]["pluggy"]["us"] > 0
+    assert report["groups"]["install"]["over_budget"]
+    assert report["missing"] == ["not-installed-pkg"]
+    assert ImportTime.failed(report, budget=0.000001)
+
+    # Missing requirements fail with a budget, import errors always fail
+    report = ImportTime(_setupReqs("install = pluggy\n  not-installed-pkg")).report(budget=1000)
+    assert not report["groups"]["install"]["over_budget"]
+    assert ImportTime.failed(report, budget=1000)
+    assert not ImportTime.failed(report)
+
+    report["groups"]["install"].update(us=None, error="No module named 'pluggy'")
+    assert ImportTime.failed(report)
+
+
+def test_render(tmpdir):
+    reqs = _setupReqs("install = requests\n  pathlib ; python_version < '3.4'\n"
+                      "test = pytest\nextra_foo = foo~=1.0")
+
+    rendered = reqs.render(requirements_txt=True)
+    assert list(rendered) == [Path("install.txt"), Path("test.txt"), Path("extra_foo.txt"),
+                              Path("requirements.txt")]
+    assert rendered[Path("install.txt")] == "pathlib ; python_version < \"3.4\"\nrequests\n"
+    assert rendered[Path("requirements.txt")] == ("foo~=1.0\npathlib ; python_version < \"3.4\"\n"
+                                                  "requests\n")
+
+    rendered = reqs.render(groups=["install"], targets=[TargetEnvironment("py3.8-linux")])
+    assert rendered == {Path("py3.8-linux", "install.txt"): "requests\n"}
+
+    out_d = Path(str(tmpdir))
+    written = reqs.write(groups=["test"], output_dir=out_d)
+    assert written == [out_d / "test.txt"]
+    assert written[0].read_text() == "pytest\n"
+
+    with pytest.raises(NotADirectoryError):
+        reqs.write(output_dir=out_d / "missing")
+
+
+def test_parseVersionSegments():
+    vstr, v = parseVersion("1!2.3.4rc1-post2.dev3+Ubuntu-1")
+    assert vstr == "1!2.3.4rc1.post2.dev3+ubuntu.1"
+    assert v == (2, 3, 4, "rc1", 1, 2, 3, "ubuntu.1")
+    assert (v.epoch, v.post, v.dev, v.local) == (1, 2, 3, "ubuntu.1")
+
+    vstr, v = parseVersion("v1.0-alpha.2")
+    assert vstr == "1.0a2"
+    assert (v.release, v.epoch, v.post, v.dev, v.local) == ("a2", 0, None, None, None)
+
+
+def test_sortVersions():
+    ordered = ["1.0.dev1", "1.0a1.dev1", "1.0a1", "1.0b1", "1.0rc1", "1.0", "1.0+abc", "1.0+5",
+               "1.0.post1.dev1", "1.0.post1", "1.0.1", "1!0.1"]
+    assert sortVersions(reversed(ordered)) == ordered
+    assert sortVersions(ordered, reverse=True) == list(reversed(ordered))
+    assert versionKey("1.0") == versionKey("1.0.0")
+
+    with pytest.raises(ValueError):
+        sortVersions(["1.0", "Slapshot"])
+    assert sortVersions(["2.0", "Slapshot", "1.0"], strict=False) == ["1.0", "2.0"]
+    assert parseVersions(["1.0-a1"]) == [("1.0-a1",) + parseVersion("1.0a1")]
+
+
+def test_query(tmpdir, monkeypatch):
+    import time
+    import threading
+    import parcyl
+
+    monkeypatch.chdir(str(tmpdir))
+    setup_cfg = Path("setup.cfg")
+    setup_cfg.write_text("[parcyl]\nversion = 1.0-a1\n[parcyl:requirements]\ninstall = foo\n")
+
+    # No server, in-process
+    assert parcyl.query({"attr": "version"}) == "1.0a1"
+
+    server = parcyl.ParcylServer()
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    try:
+        sock = parcyl._connect(server.socket_path)
+        while sock is None:
+            time.sleep(0.01)
+            sock = parcyl._connect(server.socket_path)
+
+        # Invalid requests are answered with errors
+        with sock, sock.makefile("rwb") as stream:
+            for request in (b"[1]", b"{\"attr\": [1]}", b"not json"):
+                stream.write(request + b"\n")
+                stream.flush()
+                assert "error" in json.loads(stream.readline())
+
+        assert parcyl.query({"attr": "version"}) == "1.0a1"
+        assert parcyl.query({"attr": "version_info"})["release"] == "a1"
+        assert parcyl.query({"requirements": "install"}) == ["foo"]
+        assert parcyl.query({"requirements": "extra_nope"}) == []
+        with pytest.raises(ValueError):
+            parcyl.query({"attr": "nope"})
+
+        # Reloaded when changed
+        setup_cfg.write_text("[parcyl]\nversion = 2.0\n[parcyl:requirements]\ninstall = bar\n")
+        assert parcyl.query({"attr": "version"}) == "2.0"
+        assert parcyl.query({"requirements": "install"}) == ["bar"]
+
+        # A half-edited setup.cfg is an error, not a dead server
+        setup_cfg.write_text("[parcyl]\nversion = 2.0\nversion = 2.1\n")
+        with pytest.raises(ValueError):
+            parcyl.query({"attr": "version"})
+        setup_cfg.write_text("[parcyl]\nversion = 3.0\n")
+        assert parcyl.query({"attr": "version"}) == "3.0"
+    finally:
+        server.shutdown()
+        thread.join()
+
+    assert not server.socket_path.exists()
+
+    # The same errors in-process
+    setup_cfg.write_text("[parcyl]\nversion = 2.0\nversion = 2.1\n")
+    for request in ({"attr": "version"}, ["attr"], {"attr": None}):
+        with pytest.raises(ValueError):
+            parcyl.query(request)
+
+
+def test_renderLayers():
+    reqs = _setupReqs("install = aaa\n  bbb\n  ccc\nextra_foo = ddd\ntest = eee")
+    changes = {"aaa": 3, "bbb": 0, "ccc": 1}
+
+    rendered = reqs.render(groups=["install"], layers=3, changes=changes)
+    assert rendered == {Path("install.txt"): "aaa\nbbb\nccc\n",
+                        Path("layers", "layer-0.txt"): "bbb\n",
+                        Path("layers", "layer-1.txt"): "ddd\n",
+                        Path("layers", "layer-2.txt"): "aaa\nccc\n",
+                        }
+
+    layers = reqs.render(groups=["test"], layers=10, changes=changes)
+    assert len([p for p in layers if p.parent == Path("layers")]) == 4
+
+
+def test_RequirementChanges(tmpdir, monkeypatch):
+    import subprocess
+
+    monkeypatch.chdir(str(tmpdir))
+    setup_cfg = Path("setup.cfg")
+
+    def _commit(install, cfg=setup_cfg):
+        cfg.write_text(f"[parcyl:requirements]\ninstall = {install}\n")
+        subprocess.run(f"git add {cfg} && git -c user.name=T -c user.email=t@t "
+                       "commit -q -m x", shell=True, check=True)
+
+    subprocess.run(["git", "init", "-q"], check=True)
+    _commit("aaa\n  bbb")
+    _commit("aaa\n  bbb>=2")
+    _commit("aaa\n  bbb>=2\n  ccc")
+    # Just added is not the most stable
+    assert RequirementChanges.fromGit() == {"aaa": 0, "bbb": 1, "ccc": 1}
+
+    # A project in a subdirectory of the repository
+    Path("proj").mkdir()
+    _commit("aaa", cfg=Path("proj", "setup.cfg"))
+    _commit("aaa>=2", cfg=Path("proj", "setup.cfg"))
+    monkeypatch.chdir("proj")
+    assert RequirementChanges.fromGit() == {"aaa": 1}
+    monkeypatch.chdir("..")
+
+    changes_json = Path("changes.json")
+    changes_json.write_text('{"Foo_Bar": 2, "aaa": 1}')
+    assert RequirementChanges.fromFile(changes_json) == {"foo-bar": 2, "aaa": 1}
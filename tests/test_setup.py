@@ -1,7 +1,10 @@
+import os
 import sys
+import textwrap
 import subprocess
 from collections import defaultdict
 import pytest
+from conftest import ParcylDir
 
 class _ArgsDict(defaultdict):
     def __init__(self, copy):
@@ -83,3 +86,219 @@ def test_setup_bdist_name_version(parcyl_d):
 def test_setup_sdist(parcyl_d):
     test_default_setup_sdist(parcyl_d, setup_kwargs={"name": "Grandaddy",
                                                      "version": "1.0.8"})
+
+
+def test_pytest_shards_balance():
+    from parcyl import PyTestShards
+
+    durations = {"a.py": 10.0, "b.py": 6.0, "c.py": 5.0, "d.py": 1.0}
+    shards = PyTestShards.balance(["d.py", "c.py", "b.py", "a.py"], durations, 2)
+    assert shards == [["a.py", "d.py"], ["b.py", "c.py"]]
+
+    # Unknown durations are treated as average, and never more shards than files
+    assert PyTestShards.balance(["x.py", "y.py"], {}, 4) == [["x.py"], ["y.py"]]
+
+    assert PyTestShards.mergeExitCodes([0, 0]) == 0
+    assert PyTestShards.mergeExitCodes([0, 5]) == 0
+    assert PyTestShards.mergeExitCodes([5, 5]) == 5
+    assert PyTestShards.mergeExitCodes([0, 1, 2]) == 2
+
+
+def test_setup_sdist_incremental(parcyl_d):
+    parcyl = parcyl_d.withSetupPy(setup_kwargs={"name": "Grandaddy", "version": "1.0.8"})
+    sdist = parcyl_d.path.joinpath("dist", "Grandaddy-1.0.8.tar.gz")
+
+    parcyl.setup("sdist --incremental")
+    assert sdist.exists()
+    built = sdist.stat().st_mtime_ns
+
+    # Nothing changed, the previous sdist is reused
+    parcyl.setup("sdist --incremental")
+    assert sdist.stat().st_mtime_ns == built
+
+    parcyl_d.withSetupCfg("[parcyl]\nauthor = Jason Lytle\n")
+    parcyl.setup("sdist --incremental")
+    assert sdist.stat().st_mtime_ns != built
+
+
+def test_setup_develop_fastpath(parcyl_d):
+    install_d = parcyl_d.path / "tmp"
+    install_d.mkdir()
+    env = {"PYTHONPATH": str(install_d)}
+    parcyl = parcyl_d.withSetupPy(setup_kwargs={"name": "Grandaddy", "version": "1.0.8"})
+    pkg_info = parcyl_d.path / "Grandaddy.egg-info" / "PKG-INFO"
+
+    parcyl.setup("develop --install-dir ./tmp", env=env)
+    assert pkg_info.exists()
+    developed = pkg_info.stat().st_mtime_ns
+
+    # Nothing changed, egg-info is not regenerated
+    parcyl.setup("develop --install-dir ./tmp", env=env)
+    assert pkg_info.stat().st_mtime_ns == developed
+
+    parcyl.setup("develop --install-dir ./tmp --full", env=env)
+    assert pkg_info.stat().st_mtime_ns != developed
+    developed = pkg_info.stat().st_mtime_ns
+
+    parcyl = parcyl_d.withSetupPy(setup_kwargs={"name": "Grandaddy", "version": "1.0.9"})
+    parcyl.setup("develop --install-dir ./tmp", env=env)
+    assert pkg_info.stat().st_mtime_ns != developed
+
+
+def test_setup_develop_fastpath_extension(parcyl_d):
+    install_d = parcyl_d.path / "tmp"
+    install_d.mkdir()
+    env = {"PYTHONPATH": str(install_d)}
+    foo_c = parcyl_d.path / "foo.c"
+    module_c = textwrap.dedent("""\
+        #include <Python.h>
+        static struct PyModuleDef foo = {{PyModuleDef_HEAD_INIT, "foo"}};
+        PyMODINIT_FUNC PyInit_foo(void) {{
+            PyObject *m = PyModule_Create(&foo);
+            PyModule_AddIntConstant(m, "V", {});
+            return m;
+        }}
+        """)
+    foo_c.write_text(module_c.format(1))
+    parcyl = parcyl_d.withSetupPy(contents="from setuptools import Extension\n" +
+                                  ParcylDir._SETUP_PY_FORMAT.format(
+        setup_kwargs='name="Grandaddy", version="1.0.8", '
+                     'ext_modules=[Extension("foo", ["foo.c"])]'))
+
+    def _fooV():
+        return subprocess.run([sys.executable, "-c", "import foo; print(foo.V)"],
+                              cwd=str(parcyl_d.path), check=True, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout.strip()
+
+    pkg_info = parcyl_d.path / "Grandaddy.egg-info" / "PKG-INFO"
+
+    parcyl.setup("develop --install-dir ./tmp", env=env)
+    assert _fooV() == "1"
+    developed = pkg_info.stat().st_mtime_ns
+
+    # Unchanged, the extension does not change the digest between runs
+    parcyl.setup("develop --install-dir ./tmp", env=env)
+    assert pkg_info.stat().st_mtime_ns == developed
+
+    # A changed extension source is rebuilt in place. build_ext compares whole second mtimes,
+    # so the previous build is aged to not be from the same second as the change.
+    for built in list(parcyl_d.path.glob("build/**/*")) + list(parcyl_d.path.glob("foo*.so")):
+        os.utime(str(built), (built.stat().st_atime - 5, built.stat().st_mtime - 5))
+    foo_c.write_text(module_c.format(2))
+    parcyl.setup("develop --install-dir ./tmp", env=env)
+    assert _fooV() == "2"
+
+
+def test_pytest_shards_run(tmpdir, monkeypatch, capsys):
+    from pathlib import Path
+    from parcyl import PyTestShards
+
+    monkeypatch.chdir(str(tmpdir))
+    # Verbose collection output must not matter
+    Path("setup.cfg").write_text("[tool:pytest]\naddopts = --verbose\n")
+    Path("tests").mkdir()
+    Path("tests", "test_a.py").write_text("def test_a1():\n    pass\n\n"
+                                          "def test_a2():\n    pass\n")
+    Path("tests", "test_b.py").write_text("def test_b():\n    assert False\n")
+    Path("tests", "test_c.py").write_text("def test_c():\n    pass\n")
+
+    assert PyTestShards(["tests"], 2).collect() == ["tests/test_a.py", "tests/test_b.py",
+                                                    "tests/test_c.py"]
+    # Option values are not mistaken for paths
+    assert PyTestShards(["-c", "setup.cfg", "-k", "test_a or test_c", "tests"], 2).collect() \
+        == ["tests/test_a.py", "tests/test_c.py"]
+
+    capsys.readouterr()
+    assert PyTestShards(["tests"], 2).run() == 1
+    assert "=== 2 shards: 4 tests, 1 failed" in capsys.readouterr().out
+    durations = PyTestShards([], 2).loadDurations()
+    assert set(durations) == {"tests/test_a.py", "tests/test_b.py", "tests/test_c.py"}
+
+    assert PyTestShards(["-k", "not test_b", "tests"], 3).run() == 0
+    assert "=== 2 shards: 3 tests, 0 failed" in capsys.readouterr().out
+
+
+def test_pytest_shards_cache(tmpdir, monkeypatch, capsys):
+    import json
+    from pathlib import Path
+    from parcyl import PyTestShards
+
+    monkeypatch.chdir(str(tmpdir))
+    Path("tests").mkdir()
+    for name in "abcd":
+        Path("tests", f"test_{name}.py").write_text(f"def test_{name}():\n    assert False\n")
+    lastfailed = Path(".pytest_cache", "v", "cache", "lastfailed")
+
+    # Every shard's failures are kept, not only those of the last shard to finish
+    assert PyTestShards(["tests"], 4).run() == 1
+    assert set(json.loads(lastfailed.read_text())) == {f"tests/test_{name}.py::test_{name}"
+                                                       for name in "abcd"}
+
+    Path("tests", "test_c.py").write_text("def test_c():\n    pass\n")
+    assert PyTestShards(["--lf", "tests"], 2).run() == 1
+    assert "=== 2 shards: 4 tests, 3 failed" in capsys.readouterr().out
+    assert set(json.loads(lastfailed.read_text())) == {f"tests/test_{name}.py::test_{name}"
+                                                       for name in "abd"}
+
+
+def test_pytest_shards_option(parcyl_d):
+    proc = parcyl_d.withSetupPy().setup("pytest --shards two", check=False)
+    assert proc.returncode != 0
+
+
+def test_setup_sdist_incremental_inputs(parcyl_d):
+    from pathlib import Path
+
+    data_d = parcyl_d.path / "grandaddy" / "data" / "songs"
+    data_d.mkdir(parents=True)
+    (parcyl_d.path / "grandaddy" / "__init__.py").write_text("")
+    (data_d / "he_dont.txt").write_text("1")
+    (parcyl_d.path / "notes.txt").write_text("1")
+    (parcyl_d.path / "foo.c").write_text("/* 1 */\n")
+    parcyl_d._withFile("MANIFEST.in", "include notes.txt\n")
+    parcyl = parcyl_d.withSetupPy(contents="from setuptools import Extension\n" +
+                                  ParcylDir._SETUP_PY_FORMAT.format(
+        setup_kwargs='name="Grandaddy", version="1.0.8", packages=["grandaddy"], '
+                     'package_data={"grandaddy": ["data/songs/*"]}, '
+                     'ext_modules=[Extension("foo", ["foo.c"])]'))
+    sdist = parcyl_d.path.joinpath("dist", "Grandaddy-1.0.8.tar.gz")
+
+    def _built():
+        return sdist.stat().st_mtime_ns
+
+    parcyl.setup("sdist --incremental")
+    built = _built()
+    # Extension modules do not change the metadata between runs
+    parcyl.setup("sdist --incremental")
+    assert _built() == built
+
+    # Package data in a subdirectory, MANIFEST.in files, and extension sources are build inputs
+    for changed in (data_d / "he_dont.txt", parcyl_d.path / "notes.txt",
+                    parcyl_d.path / "foo.c"):
+        changed.write_text(changed.read_text() + "\n")
+        parcyl.setup("sdist --incremental")
+        assert _built() != built
+        built = _built()
+
+    # Only sdist and bdist_wheel are reused, other commands always run
+    parcyl.setup("sdist --incremental build")
+    assert _built() != built
+    assert list(Path(parcyl_d.path / "build").glob("lib*/grandaddy/__init__.py"))
+
+
+def test_setup_develop_pip_failure(parcyl_d):
+    install_d = parcyl_d.path / "tmp"
+    install_d.mkdir()
+    # No index, so installing the dev requirement fails
+    env = {"PYTHONPATH": str(install_d), "PIP_NO_INDEX": "1"}
+    parcyl = parcyl_d.withSetupPy(setup_kwargs={"name": "Grandaddy", "version": "1.0.8"})
+    parcyl_d.withSetupCfg("[parcyl:requirements]\ndev = not-a-real-package-grandaddy\n")
+    pkg_info = parcyl_d.path / "Grandaddy.egg-info" / "PKG-INFO"
+
+    parcyl.setup("develop --install-dir ./tmp", env=env)
+    assert not parcyl_d.path.joinpath("build", "parcyl", "develop.digest").exists()
+    developed = pkg_info.stat().st_mtime_ns
+
+    # Not skipped, the install is attempted again
+    parcyl.setup("develop --install-dir ./tmp", env=env)
+    assert pkg_info.stat().st_mtime_ns != developed